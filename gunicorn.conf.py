@@ -0,0 +1,18 @@
+# Production server config: gunicorn -c gunicorn.conf.py send_email_resend:app
+#
+# Dashboard state (latest_data, history, alerts) lives in process memory, so we
+# run a single worker process and get request concurrency from its thread pool.
+# Each extra worker would need its own poller and would hit the Growatt API again.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+workers = 1
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+keepalive = 75  # outlasts the dashboard's 60 s /api/latest refresh check, so browsers reuse the socket
+timeout = 60
+
+
+def post_worker_init(worker):
+    from send_email_resend import start_poller
+    start_poller()
@@ -1,17 +1,32 @@
 import os
 import time
+import logging
+import random
+import socket
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import quote_plus
 import json
+import orjson
+import hashlib
+import gzip
 from datetime import datetime, timedelta, timezone
-from threading import Thread
-from flask import Flask, render_template_string, request, jsonify
+from threading import Thread, Lock, Event
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from itertools import count
+from flask import Flask, Response, request, jsonify
 import numpy as np
-from collections import deque
+from collections import deque, defaultdict
+from array import array
+from bisect import bisect_left, bisect_right
 
 # ----------------------------
 # Flask app
 # ----------------------------
 app = Flask(__name__)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(message)s")
+log = logging.getLogger(__name__)
 
 # ----------------------------
 # Growatt Config (from env)
@@ -20,6 +35,10 @@ API_URL = "https://openapi.growatt.com/v1/device/storage/storage_last_data"
 TOKEN = os.getenv("API_TOKEN")
 SERIAL_NUMBERS = os.getenv("SERIAL_NUMBERS", "").split(",")
 POLL_INTERVAL_MINUTES = int(os.getenv("POLL_INTERVAL_MINUTES", 5))
+POLL_FETCH_TIMEOUT = 45  # seconds a cycle waits for all inverters before treating stragglers as unanswered
+HISTORY_DAYS = 14
+HISTORY_MAX_POINTS = HISTORY_DAYS * 24 * 60 // POLL_INTERVAL_MINUTES + 1
+HISTORY_CHART_POINTS = 150  # upper bound on points sent to the history chart
 
 # ----------------------------
 # Inverter Configuration
@@ -29,6 +48,10 @@ INVERTER_CONFIG = {
     "KAM4N5W0AG": {"label": "Inverter 2", "type": "primary", "datalog": "DDD0B02121", "display_order": 2},
     "JNK1CDR0KQ": {"label": "Inverter 3 (Backup)", "type": "backup", "datalog": "DDD0B0221H", "display_order": 3}
 }
+PRIMARY_BATTERY_SNS = frozenset(sn for sn, cfg in INVERTER_CONFIG.items() if cfg["type"] == "primary")
+# Dashboard row order, fixed at startup (unknown serials keep their SERIAL_NUMBERS order, last)
+ORDERED_SNS = tuple(sorted(SERIAL_NUMBERS, key=lambda sn: INVERTER_CONFIG.get(sn, {}).get("display_order", 99)))
+STORAGE_SN_BODIES = {sn: f"storage_sn={quote_plus(sn)}".encode() for sn in SERIAL_NUMBERS}
 
 # Thresholds & Battery Specs
 PRIMARY_BATTERY_THRESHOLD = 40
@@ -61,12 +84,72 @@ LONGITUDE = 36.77683
 RESEND_API_KEY = os.getenv('RESEND_API_KEY')
 SENDER_EMAIL = os.getenv('SENDER_EMAIL')
 RECIPIENT_EMAIL = os.getenv('RECIPIENT_EMAIL')
+ALERT_MAX_PER_WINDOW = int(os.getenv("ALERT_MAX_PER_WINDOW", 1))
+# Battery/discharge alerts fire only once their condition held in 3 of the last 5 polls
+ALERT_DEBOUNCE_SAMPLES = 5
+ALERT_DEBOUNCE_REQUIRED = 3
+
+# Alert emails as (subject, html) per alert type; {placeholders} are filled only after the rate-limit gate
+ALERT_TEMPLATES = {
+    "communication_lost": ("⚠️ Comm Lost: {labels}", "Check inverter"),
+    "fault_alarm": ("🚨 FAULT: {labels}", "Fault code"),
+    "high_temperature": ("🌡️ High Temp: {labels}", "{readings}"),
+    "critical": ("🚨 CRITICAL: Generator Running", "Backup critical"),
+    "backup_active": ("⚠️ HIGH ALERT: Backup Active", "Reduce Load"),
+    "warning": ("⚠️ Primary Low", "Reduce Load"),
+    "very_high_load": ("🚨 URGENT: High Discharge", "Critical"),
+    "high_load": ("⚠️ High Discharge", "Warning"),
+    "moderate_load": ("ℹ️ Moderate Discharge", "Info"),
+    "high_load_continuous": ("⚠️ HIGH LOAD ALERT: Pool Pumps?", "Battery discharge has been over 1.1kW for {hours} hours. Did you leave the pool pumps on?")
+}
 
 # ----------------------------
 # Globals
 # ----------------------------
-headers = {"token": TOKEN, "Content-Type": "application/x-www-form-urlencoded"}
-last_alert_time = {}
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter whose sockets send small requests immediately and stay alive between polls"""
+    socket_options = [
+        (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    ]
+    # Probe idle connections well inside the 5-minute poll gap (Linux-only options)
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        socket_options += [
+            (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 30),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 4)
+        ]
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+def make_session(pool_maxsize=4, retries=3, schemes=("https://",), retry=None):
+    """Keep-alive session whose transient errors are retried with backoff inside the call (or per `retry`)"""
+    s = requests.Session()
+    s.headers["Connection"] = "keep-alive"
+    adapter = KeepAliveAdapter(
+        pool_connections=4, pool_maxsize=pool_maxsize,
+        max_retries=retry or Retry(total=retries, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET", "POST"])
+    )
+    for scheme in schemes: s.mount(scheme, adapter)
+    return s
+
+# One pool per upstream, so the Growatt token never rides along to another host
+growatt_session = make_session(max(len(SERIAL_NUMBERS), 4))
+growatt_session.headers.update({"token": TOKEN, "Content-Type": "application/x-www-form-urlencoded"})
+# A Resend POST is a whole batch of emails: only retry when it provably wasn't processed (connection
+# refused, or 429 rate limited). A 5xx or read timeout may already have sent them, so never resend then
+resend_session = make_session(retry=Retry(total=3, connect=3, read=0, other=0, status=3, backoff_factor=0.3,
+                                          status_forcelist=[429], allowed_methods=["POST"], raise_on_status=False))
+if RESEND_API_KEY: resend_session.headers["Authorization"] = f"Bearer {RESEND_API_KEY}"
+# Weather has fallback sources, so fail over after one retry instead of three
+weather_session = make_session(retries=1, schemes=("https://", "http://"))
+poll_executor = ThreadPoolExecutor(max_workers=min(len(SERIAL_NUMBERS), 8))
+weather_executor = ThreadPoolExecutor(max_workers=3)  # one per weather source
+alert_send_log = defaultdict(lambda: deque(maxlen=ALERT_MAX_PER_WINDOW))
+alert_condition_windows = defaultdict(lambda: deque(maxlen=ALERT_DEBOUNCE_SAMPLES))
+alert_outbox = []  # (alert_type, subject, html, now) queued during a poll cycle; only the poll thread touches it
 latest_data = {
     "timestamp": "Initializing...",
     "total_output_power": 0,
@@ -78,7 +161,7 @@ latest_data = {
     "backup_active": False,
     "backup_percent_calc": 0,
     "generator_running": False,
-    "inverters": [],
+    "inverters": (),
     "solar_forecast": [],
     "load_forecast": [],
     "battery_life_prediction": None,
@@ -89,25 +172,49 @@ latest_data = {
         "total_kwh": 0,
         "total_pct": 0,
         "total_usable_capacity": 29.76
-    }
+    },
+    "history_json": orjson.dumps({"times": [], "load": [], "battery": []})
 }
-load_history = []
-battery_history = []
+# History as parallel columns (struct-of-arrays): index i of each belongs to the same sample.
+# Packed arrays instead of (datetime, float) tuples; trimmed to HISTORY_MAX_POINTS each poll
+history_times = array('d')  # epoch seconds, non-decreasing, so bisect finds window edges
+load_history = array('H')  # whole watts (uint16): sub-watt precision is noise and the site peaks well below 65 kW
+battery_history = array('H')
+history_labels = []  # chart label per sample, formatted once at append time
+HISTORY_COLUMNS = (history_times, load_history, battery_history, history_labels)
 weather_forecast = {}
 weather_source = "Initializing..."
-solar_conditions_cache = None
-alert_history = []
+solar_conditions_memo = (None, None, None)  # (forecast, hour key, result) of the last analysis
+# Oldest first; aged out from the left. Readers snapshot it with tuple() (one C call) before iterating
+alert_history = deque()
 last_communication = {}
+cached_page = (None, None, None, None)  # (etag, utf-8 body, gzipped body, Last-Modified) of the last dashboard render
+# Bumped whenever something the dashboard shows changes; next() on a count is atomic across threads
+render_counter = count(1)
+render_version = 0
+boot_id = f"{time.time_ns():x}"  # keeps ETags from a previous process from matching after a restart
+poller_lock = Lock()
+poller_started = False
+first_weather_done = Event()  # set after the first forecast attempt; the first poll waits for it
 
 pool_pump_start_time = None
 pool_pump_last_alert = None
 
 solar_forecast = []
-solar_generation_pattern = deque(maxlen=5000)
-load_demand_pattern = deque(maxlen=5000)
+# Last 5000 (hour, value) samples per pattern, plus running per-hour sums and counts over exactly those
+# samples, so the hourly means come from 24-slot arrays instead of a pass over the whole window
+solar_generation_pattern = deque(maxlen=5000)  # value: generation as a fraction of TOTAL_SOLAR_CAPACITY_KW
+load_demand_pattern = deque(maxlen=5000)  # value: load in watts
+solar_hour_sums, solar_hour_counts = np.zeros(24), np.zeros(24, dtype=np.int64)
+load_hour_sums, load_hour_counts = np.zeros(24), np.zeros(24, dtype=np.int64)
 SOLAR_EFFICIENCY_FACTOR = 0.85
 FORECAST_HOURS = 12
+ALERT_HISTORY_WINDOW = timedelta(hours=12)
+WEATHER_REFRESH_MINUTES = 30
+WEATHER_FETCH_TIMEOUT = 30  # seconds to wait for any source to answer
+WEATHER_STALE_MAX = timedelta(hours=6)  # keep serving the last real forecast this long when every source fails
 EAT = timezone(timedelta(hours=3))
+EAT_OFFSET_S = 3 * 3600
 
 # ----------------------------
 # Battery Calculation Function
@@ -148,15 +255,15 @@ def calculate_usable_energy(primary_pct, backup_pct):
 def get_weather_from_openmeteo():
     try:
         url = f"https://api.open-meteo.com/v1/forecast?latitude={LATITUDE}&longitude={LONGITUDE}&hourly=cloud_cover,shortwave_radiation&timezone=Africa/Nairobi&forecast_days=2"
-        response = requests.get(url, timeout=10)
-        return {'times': response.json()['hourly']['time'], 'cloud_cover': response.json()['hourly']['cloud_cover'], 'solar_radiation': response.json()['hourly']['shortwave_radiation'], 'source': 'Open-Meteo'}
+        hourly = orjson.loads(weather_session.get(url, timeout=10).content)['hourly']
+        return {'times': hourly['time'], 'cloud_cover': hourly['cloud_cover'], 'solar_radiation': hourly['shortwave_radiation'], 'source': 'Open-Meteo'}
     except: return None
 
 def get_weather_from_weatherapi():
     try:
         WEATHERAPI_KEY = os.getenv("WEATHERAPI_KEY") 
         url = f"http://api.weatherapi.com/v1/forecast.json?key={WEATHERAPI_KEY}&q={LATITUDE},{LONGITUDE}&days=2"
-        response = requests.get(url, timeout=10)
+        response = weather_session.get(url, timeout=10)
         if response.status_code == 200:
             data = response.json()
             times, cloud, solar = [], [], []
@@ -172,13 +279,13 @@ def get_weather_from_weatherapi():
 def get_weather_from_7timer():
     try:
         url = f"http://www.7timer.info/bin/api.pl?lon={LONGITUDE}&lat={LATITUDE}&product=civil&output=json"
-        response = requests.get(url, timeout=15)
+        response = weather_session.get(url, timeout=15)
         data = response.json()
         times, cloud, solar = [], [], []
         base = datetime.now(EAT)
         for item in data.get('dataseries', [])[:48]:
             t = base + timedelta(hours=item.get('timepoint', 0))
-            times.append(t.strftime('%Y-%m-dT%H:%M'))
+            times.append(t.strftime('%Y-%m-%dT%H:%M'))
             c_pct = min((item.get('cloudcover', 5) * 12), 100)
             cloud.append(c_pct)
             solar.append(max(800 * (1 - c_pct/100), 0))
@@ -197,21 +304,56 @@ def get_fallback_weather():
         rads.append(max(0, 1000 - (abs(12 - h) * 150)) if 6 <= h <= 18 else 0)
     return {'times': times, 'cloud_cover': clouds, 'solar_radiation': rads, 'source': 'Synthetic (Offline)'}
 
+def parse_forecast_time(t_str):
+    """Parse a forecast time by slicing. Every source reports EAT wall time as 'YYYY-MM-DD?HH:MM...'"""
+    return datetime(int(t_str[0:4]), int(t_str[5:7]), int(t_str[8:10]), int(t_str[11:13]), int(t_str[14:16]), tzinfo=EAT)
+
+def index_forecast(f):
+    """Parse a forecast once into time-sorted numpy columns (epoch s, cloud %, radiation); unparseable rows are dropped"""
+    rows = []
+    for t_str, c, s in zip(f['times'], f['cloud_cover'], f['solar_radiation']):
+        try: rows.append((parse_forecast_time(t_str).timestamp(), float(c), float(s)))
+        except: continue
+    cols = np.array(rows, dtype=float).reshape(-1, 3)
+    cols = cols[np.argsort(cols[:, 0], kind='stable')]
+    f['t_epoch'], f['cloud_np'], f['solar_np'] = cols[:, 0], cols[:, 1], cols[:, 2]
+    return f
+
+WEATHER_SOURCES = (get_weather_from_openmeteo, get_weather_from_weatherapi, get_weather_from_7timer)
+
 def get_weather_forecast():
     global weather_source
-    print("🌤️ Fetching weather forecast...")
-    for src, func in [("Open-Meteo", get_weather_from_openmeteo), ("WeatherAPI", get_weather_from_weatherapi), ("7Timer", get_weather_from_7timer)]:
-        f = func()
-        if f and len(f.get('times', [])) > 0:
-            weather_source = f['source']
-            return f
+    log.info("🌤️ Fetching weather forecast...")
+    now = datetime.now(EAT)
+    # Query every source at once, so a slow or dead source costs its own timeout only, not the sum of all
+    # of them. WEATHER_SOURCES is in preference order: settle on the best usable answer as soon as every
+    # source ahead of it has failed, or on the best in hand when the deadline passes
+    futures = {weather_executor.submit(func): i for i, func in enumerate(WEATHER_SOURCES)}
+    results = [None] * len(WEATHER_SOURCES)
+    settled = 0  # sources [0, settled) have all answered
+    for fut in completed_within(futures, WEATHER_FETCH_TIMEOUT):
+        f = fut.result()  # the fetchers swallow their own errors and return None
+        results[futures[fut]] = f if f and len(f.get('times', [])) > 0 else False
+        while settled < len(results) and results[settled] is False: settled += 1
+        if settled < len(results) and results[settled]: break
+    for fut in futures: fut.cancel()
+    f = next((r for r in results if r), None)
+    if f:
+        f['fetched_at'] = now
+        weather_source = f['source']
+        return index_forecast(f)
+    # Stale-if-error: a few-hours-old real forecast beats the synthetic curve
+    last = weather_forecast
+    if 'fetched_at' in last and now - last['fetched_at'] <= WEATHER_STALE_MAX:
+        weather_source = f"{last['source']} (stale)"
+        return last
     weather_source = "Synthetic (Offline)"
-    return get_fallback_weather()
+    return index_forecast(get_fallback_weather())
 
-def analyze_solar_conditions(forecast):
+def analyze_solar_conditions(forecast, now=None):
     if not forecast: return None
     try:
-        now = datetime.now(EAT)
+        now = now or datetime.now(EAT)
         h = now.hour
         is_night = h < 6 or h >= 18
         if is_night:
@@ -223,74 +365,78 @@ def analyze_solar_conditions(forecast):
             end = now.replace(hour=18, minute=0)
             label = "Today's Remaining Daylight"
         
-        c_sum, s_sum, count = 0, 0, 0
-        for i, t_str in enumerate(forecast['times']):
-            try:
-                ft = datetime.fromisoformat(t_str.replace('Z', '')) if 'T' in t_str else datetime.strptime(t_str, '%Y-%m-%d %H:%M')
-                ft = ft.replace(tzinfo=EAT) if ft.tzinfo is None else ft.astimezone(EAT)
-                if start <= ft <= end and 6 <= ft.hour <= 18:
-                    c_sum += forecast['cloud_cover'][i]
-                    s_sum += forecast['solar_radiation'][i]
-                    count += 1
-            except: continue
-        
-        if count > 0:
+        t = forecast['t_epoch']
+        hours = (t + EAT_OFFSET_S) // 3600 % 24
+        mask = (t >= start.timestamp()) & (t <= end.timestamp()) & (hours >= 6) & (hours <= 18)
+        if mask.any():
+            avg_cloud = float(forecast['cloud_np'][mask].mean())
+            avg_solar = float(forecast['solar_np'][mask].mean())
             return {
-                'avg_cloud_cover': c_sum/count,
-                'avg_solar_radiation': s_sum/count,
-                'poor_conditions': (c_sum/count) > 70 or (s_sum/count) < 200,
+                'avg_cloud_cover': avg_cloud,
+                'avg_solar_radiation': avg_solar,
+                'poor_conditions': avg_cloud > 70 or avg_solar < 200,
                 'analysis_period': label,
                 'is_nighttime': is_night
             }
     except: pass
     return None
 
+def get_solar_conditions(now=None):
+    """analyze_solar_conditions for the current forecast, recomputed only when the forecast or the hour changes"""
+    global solar_conditions_memo
+    now = now or datetime.now(EAT)
+    forecast, hour_key = weather_forecast, now.strftime('%Y%m%d%H')
+    memo_forecast, memo_hour, result = solar_conditions_memo
+    if forecast is not memo_forecast or hour_key != memo_hour:
+        result = analyze_solar_conditions(forecast, now)
+        solar_conditions_memo = (forecast, hour_key, result)  # one rebind; readers on other threads see old or new
+    return result
+
 # Helper Functions
+# storage_last_data fields the poll reads, with their types. Growatt reports numbers as strings and
+# sends blanks/None for missing readings, so each is coerced as cast(value or 0) in one pass per inverter
+NUMERIC_FIELDS = (
+    ("outPutPower", float), ("capacity", float), ("vBat", float), ("pBat", float), ("ppv", float), ("ppv2", float),
+    ("invTemperature", float), ("dcDcTemperature", float), ("temperature", float), ("vac", float), ("pAcInPut", float),
+    ("errorCode", int)
+)
+
+# Backup voltage bands: BACKUP_VOLTAGE_BOUNDS[i] is the lower edge of BACKUP_VOLTAGE_BANDS[i + 1]
+BACKUP_VOLTAGE_BOUNDS = (BACKUP_VOLTAGE_MEDIUM, BACKUP_VOLTAGE_GOOD)
+BACKUP_VOLTAGE_BANDS = (("Low", "red"), ("Medium", "orange"), ("Good", "green"))
+
 def get_backup_voltage_status(voltage):
-    if voltage >= BACKUP_VOLTAGE_GOOD: return "Good", "green"
-    elif voltage >= BACKUP_VOLTAGE_MEDIUM: return "Medium", "orange"
-    else: return "Low", "red"
+    return BACKUP_VOLTAGE_BANDS[bisect_right(BACKUP_VOLTAGE_BOUNDS, voltage)]
 
-def check_generator_running(backup_data):
-    if not backup_data: return False
-    return float(backup_data.get('vac', 0) or 0) > 100 or float(backup_data.get('pAcInPut', 0) or 0) > 50
+def check_generator_running(vals):
+    """Generator is feeding the backup inverter; vals are its NUMERIC_FIELDS readings, already coerced"""
+    return vals['vac'] > 100 or vals['pAcInPut'] > 50
+
+def hourly_means(sums, counts):
+    """(hours, means) for every hour of day with at least one sample"""
+    hours = np.flatnonzero(counts)
+    return hours.tolist(), (sums[hours] / counts[hours]).tolist()
 
 def analyze_historical_solar_pattern():
     if len(solar_generation_pattern) < 3: return None
-    pattern, hour_map = [], {}
-    for d in solar_generation_pattern:
-        h = d['hour']
-        if h not in hour_map: hour_map[h] = []
-        hour_map[h].append(d['generation'] / d.get('max_possible', TOTAL_SOLAR_CAPACITY_KW * 1000))
-    for h, v in hour_map.items(): pattern.append((h, np.mean(v)))
-    return pattern
+    return list(zip(*hourly_means(solar_hour_sums, solar_hour_counts)))
 
 def analyze_historical_load_pattern():
     if len(load_demand_pattern) < 3: return None
-    pattern, hour_map = [], {}
-    for d in load_demand_pattern:
-        h = d['hour']
-        if h not in hour_map: hour_map[h] = []
-        hour_map[h].append(d['load'])
-    for h, v in hour_map.items(): pattern.append((h, 0, np.mean(v)))
-    return pattern
+    hours, means = hourly_means(load_hour_sums, load_hour_counts)
+    return [(h, 0, m) for h, m in zip(hours, means)]
 
-def get_hourly_weather_forecast(weather_data, num_hours=12):
+def get_hourly_weather_forecast(weather_data, num_hours=12, now=None):
     hourly = []
-    now = datetime.now(EAT)
-    if not weather_data: return hourly
-    w_times = []
-    for i, t_str in enumerate(weather_data['times']):
-        try:
-            ft = datetime.fromisoformat(t_str.replace('Z', '')) if 'T' in t_str else datetime.strptime(t_str, '%Y-%m-%d %H:%M')
-            ft = ft.replace(tzinfo=EAT) if ft.tzinfo is None else ft.astimezone(EAT)
-            w_times.append({'time': ft, 'cloud': weather_data['cloud_cover'][i], 'solar': weather_data['solar_radiation'][i]})
-        except: continue
-    w_times.sort(key=lambda x: x['time'])
-    for i in range(num_hours):
-        ft = now + timedelta(hours=i)
-        closest = min(w_times, key=lambda x: abs(x['time'] - ft))
-        hourly.append({'time': ft, 'hour': ft.hour, 'cloud_cover': closest['cloud'], 'solar_radiation': closest['solar']})
+    now = now or datetime.now(EAT)
+    if not weather_data or not len(weather_data.get('t_epoch', ())): return hourly
+    targets = [now + timedelta(hours=i) for i in range(num_hours)]
+    # Nearest forecast row for every target hour in one broadcast; argmin keeps the earliest row on ties
+    t = weather_data['t_epoch']
+    idx = np.abs(t[None, :] - np.array([ft.timestamp() for ft in targets])[:, None]).argmin(axis=1)
+    cloud, solar = weather_data['cloud_np'][idx].tolist(), weather_data['solar_np'][idx].tolist()
+    for ft, c, s in zip(targets, cloud, solar):
+        hourly.append({'time': ft, 'hour': ft.hour, 'cloud_cover': c, 'solar_radiation': s})
     return hourly
 
 def apply_solar_curve(gen, hour):
@@ -298,9 +444,9 @@ def apply_solar_curve(gen, hour):
     curve = np.sin(((hour - 6) / 13.0) * np.pi) ** 2
     return gen * curve * (0.7 if hour <= 7 or hour >= 18 else 1.0)
 
-def generate_solar_forecast(weather_data, pattern):
+def generate_solar_forecast(weather_data, pattern, now=None):
     forecast = []
-    hourly = get_hourly_weather_forecast(weather_data, FORECAST_HOURS)
+    hourly = get_hourly_weather_forecast(weather_data, FORECAST_HOURS, now)
     max_gen = TOTAL_SOLAR_CAPACITY_KW * 1000
     for d in hourly:
         h = d['hour']
@@ -316,15 +462,15 @@ def generate_solar_forecast(weather_data, pattern):
         forecast.append({'time': d['time'], 'hour': h, 'estimated_generation': max(0, est)})
     return forecast
 
-def calculate_moving_average_load(mins=45):
-    cutoff = datetime.now(EAT) - timedelta(minutes=mins)
-    recent = [p for t, p in load_history if t >= cutoff]
+def calculate_moving_average_load(mins=45, now=None):
+    cutoff = (now or datetime.now(EAT)) - timedelta(minutes=mins)
+    recent = load_history[bisect_left(history_times, cutoff.timestamp()):]
     return sum(recent) / len(recent) if recent else 0
 
-def generate_load_forecast(pattern, current_avg=0):
+def generate_load_forecast(pattern, current_avg=0, now=None):
     """Generate load forecast with proper fallback to time-based averages"""
     forecast = []
-    now = datetime.now(EAT)
+    now = now or datetime.now(EAT)
     
     for i in range(FORECAST_HOURS):
         ft = now + timedelta(hours=i)
@@ -395,227 +541,457 @@ def calculate_battery_cascade(solar, load, p_pct, b_active=False):
     
     return {'trace_total_pct': trace, 'generator_needed': gen_needed, 'time_empty': empty_time, 'switchover_occurred': switch_occurred, 'genset_hours': acc_gen_wh/5000}
 
-def update_patterns(solar, load):
-    now = datetime.now(EAT)
+def build_history_json():
+    """Downsample the history to at most HISTORY_CHART_POINTS and serialize it for /api/history"""
+    step = max(1, -(-len(load_history) // HISTORY_CHART_POINTS))  # ceil, so the cap holds for any history length
+    return orjson.dumps({
+        'times': history_labels[::step],
+        'load': load_history[::step].tolist(),
+        'battery': battery_history[::step].tolist()
+    })
+
+def add_pattern_sample(samples, sums, counts, hour, value):
+    """Append to a bounded pattern window, keeping its per-hour sums and counts in step (O(1) per sample)"""
+    if len(samples) == samples.maxlen:
+        old_hour, old_value = samples[0]  # about to be evicted by the append
+        counts[old_hour] -= 1
+        # Reset an emptied hour so float rounding from repeated subtraction can't linger
+        sums[old_hour] = sums[old_hour] - old_value if counts[old_hour] else 0.0
+    samples.append((hour, value))
+    sums[hour] += value
+    counts[hour] += 1
+
+def update_patterns(solar, load, now=None):
+    now = now or datetime.now(EAT)
     h = now.hour
     clean_s = 0.0 if (h < 6 or h >= 19) else solar
-    solar_generation_pattern.append({'timestamp': now, 'hour': h, 'generation': clean_s, 'max_possible': 10000})
-    load_demand_pattern.append({'timestamp': now, 'hour': h, 'load': load})
-
-def send_email(subject, html, alert_type="general", send_via_email=True):
-    global last_alert_time, alert_history
-    cooldown = 120
-    if "critical" in alert_type: cooldown = 60
-    elif "very_high" in alert_type: cooldown = 30
+    add_pattern_sample(solar_generation_pattern, solar_hour_sums, solar_hour_counts, h, clean_s / (TOTAL_SOLAR_CAPACITY_KW * 1000))
+    add_pattern_sample(load_demand_pattern, load_hour_sums, load_hour_counts, h, load)
+
+
+def can_send_alert(alert_type):
+    """True if alert_type still has a free slot in its rate-limit window; check before building a body"""
+    window = 120
+    if "critical" in alert_type: window = 60
+    elif "very_high" in alert_type: window = 30
+    
+    # Sliding window: at most ALERT_MAX_PER_WINDOW sends per alert type in the last `window` minutes.
+    # Monotonic seconds, so a wall-clock jump (NTP step, host resume) can't reopen or stall the window
+    sent = alert_send_log[alert_type]
+    window_start = time.monotonic() - window * 60
+    while sent and sent[0] < window_start: sent.popleft()
+    return len(sent) < ALERT_MAX_PER_WINDOW
+
+def prune_alert_history(now):
+    """Drop alerts older than ALERT_HISTORY_WINDOW"""
+    alert_cutoff = now - ALERT_HISTORY_WINDOW
+    while alert_history and alert_history[0]['timestamp'] < alert_cutoff: alert_history.popleft()
+
+def record_alert(alert_type, subject, now):
+    """Count a delivered alert against its rate limit and show it on the dashboard"""
+    alert_send_log[alert_type].append(time.monotonic())
+    # "time" is formatted once here rather than on every dashboard/API read
+    alert_history.append({"timestamp": now, "time": now.strftime("%H:%M"), "type": alert_type, "subject": subject})
+    prune_alert_history(now)
+    bump_render_version()
+
+def send_email(subject, html, alert_type="general", send_via_email=True, now=None, ctx=None):
+    """Queue an alert for this cycle's Resend batch (see flush_alerts); dashboard-only alerts are recorded at once"""
+    if not can_send_alert(alert_type) or any(q[0] == alert_type for q in alert_outbox): return False
+    now = now or datetime.now(EAT)
+    if ctx is not None: subject, html = subject.format_map(ctx), html.format_map(ctx)
     
-    if alert_type in last_alert_time and (datetime.now(EAT) - last_alert_time[alert_type]) < timedelta(minutes=cooldown):
-        return False
-        
-    success = False
     if send_via_email and all([RESEND_API_KEY, SENDER_EMAIL, RECIPIENT_EMAIL]):
-        try:
-            r = requests.post("https://api.resend.com/emails", headers={"Authorization": f"Bearer {RESEND_API_KEY}"}, json={"from": SENDER_EMAIL, "to": [RECIPIENT_EMAIL], "subject": subject, "html": html})
-            if r.status_code == 200: success = True
-        except: pass
-    else: success = True
+        alert_outbox.append((alert_type, subject, html, now))
+    else:
+        record_alert(alert_type, subject, now)
+    return True
+
+def flush_alerts():
+    """Deliver every alert queued this cycle in one Resend batch request"""
+    if not alert_outbox: return
+    batch = alert_outbox[:]
+    alert_outbox.clear()
+    try:
+        r = resend_session.post("https://api.resend.com/emails/batch",
+                                json=[{"from": SENDER_EMAIL, "to": [RECIPIENT_EMAIL], "subject": subject, "html": html} for _, subject, html, _ in batch],
+                                timeout=20)
+        ok = r.status_code == 200
+        if not ok: log.error("Resend rejected %d alert(s): HTTP %s %s", len(batch), r.status_code, r.text[:500])
+    except Exception as e:
+        log.error("Error sending %d alert(s): %s", len(batch), e)
+        ok = False
+    # The batch is all-or-nothing. Failed alerts are not kept in the outbox (a 5xx may already have been
+    # delivered); they stay unrecorded instead, so an alert whose condition still holds is re-queued next cycle
+    if ok:
+        for alert_type, subject, _, now in batch: record_alert(alert_type, subject, now)
+
+# Battery/discharge alerts in priority order: (alert_type, condition, stops the ladder, email only while backup is active)
+ALERT_LADDER = (
+    ("critical", lambda s: s["gen_run"] or s["b_volt"] < 51.2, True, False),
+    ("backup_active", lambda s: s["b_active"] and s["p_cap"] < 40, True, False),
+    ("warning", lambda s: 40 < s["p_cap"] < 50, False, True),
+    ("very_high_load", lambda s: s["discharge"] >= 4500, False, True),
+    ("high_load", lambda s: 2500 <= s["discharge"] < 4500, False, True),
+    ("moderate_load", lambda s: 1500 <= s["discharge"] < 2000 and s["p_cap"] < 50, False, True)
+)
+
+def debounced(alert_type, active):
+    """Record this poll's reading of a condition; True if it holds now and in enough recent polls"""
+    win = alert_condition_windows[alert_type]
+    win.append(active)
+    return active and sum(win) >= ALERT_DEBOUNCE_REQUIRED
+
+def send_alert(alert_type, ctx=None, send_via_email=True, now=None):
+    """Send the ALERT_TEMPLATES entry for alert_type"""
+    subject, html = ALERT_TEMPLATES[alert_type]
+    return send_email(subject, html, alert_type, send_via_email=send_via_email, now=now, ctx=ctx)
+
+def check_alerts(inv_data, solar, total_solar, bat_discharge, gen_run, now):
+    # One email per condition naming every affected inverter; per-inverter sends shared one
+    # rate-limit slot, so all but the first were dropped anyway. Check the slot before building text
+    lost = [i['Label'] for i in inv_data if i.get('communication_lost')]
+    faults = [i['Label'] for i in inv_data if i.get('has_fault')]
+    hot = [i for i in inv_data if i.get('high_temperature')]
+    if lost and can_send_alert("communication_lost"): send_alert("communication_lost", {"labels": ", ".join(lost)}, now=now)
+    if faults and can_send_alert("fault_alarm"): send_alert("fault_alarm", {"labels": ", ".join(faults)}, now=now)
+    if hot and can_send_alert("high_temperature"):
+        send_alert("high_temperature", {"labels": ", ".join(i['Label'] for i in hot),
+                                        "readings": "<br>".join(f"{i['Label']} Temp: {i['temperature']}" for i in hot)}, now=now)
     
-    if success:
-        now = datetime.now(EAT)
-        last_alert_time[alert_type] = now
-        alert_history.append({"timestamp": now, "type": alert_type, "subject": subject})
-        alert_history[:] = [a for a in alert_history if a['timestamp'] >= (now - timedelta(hours=12))]
-        return True
-    return False
-
-def check_alerts(inv_data, solar, total_solar, bat_discharge, gen_run):
-    inv1 = next((i for i in inv_data if i['SN'] == 'RKG3B0400T'), None)
-    inv2 = next((i for i in inv_data if i['SN'] == 'KAM4N5W0AG'), None)
-    inv3 = next((i for i in inv_data if i['SN'] == 'JNK1CDR0KQ'), None)
-    if not all([inv1, inv2, inv3]): return
+    by_sn = {i['SN']: i for i in inv_data}
+    inv1, inv2, inv3 = by_sn.get('RKG3B0400T'), by_sn.get('KAM4N5W0AG'), by_sn.get('JNK1CDR0KQ')
+    # Battery alerts need live readings from all three; comm-lost rows carry no Capacity/vBat
+    if not all([inv1, inv2, inv3]) or any(i.get('communication_lost') for i in (inv1, inv2, inv3)): return
     
     p_cap = min(inv1['Capacity'], inv2['Capacity'])
     b_active = inv3['OutputPower'] > 50
     b_volt = inv3['vBat']
     
-    for inv in inv_data:
-        if inv.get('communication_lost'): send_email(f"⚠️ Comm Lost: {inv['Label']}", "Check inverter", "communication_lost")
-        if inv.get('has_fault'): send_email(f"🚨 FAULT: {inv['Label']}", "Fault code", "fault_alarm")
-        if inv.get('high_temperature'): send_email(f"🌡️ High Temp: {inv['Label']}", f"Temp: {inv['temperature']}", "high_temperature")
-        
-    if gen_run or b_volt < 51.2:
-        send_email("🚨 CRITICAL: Generator Running", "Backup critical", "critical")
-        return
-    if b_active and p_cap < 40:
-        send_email("⚠️ HIGH ALERT: Backup Active", "Reduce Load", "backup_active")
-        return
-    if 40 < p_cap < 50:
-        send_email("⚠️ Primary Low", "Reduce Load", "warning", send_via_email=b_active)
-    
-    if bat_discharge >= 4500: send_email("🚨 URGENT: High Discharge", "Critical", "very_high_load", send_via_email=b_active)
-    elif 2500 <= bat_discharge < 4500: send_email("⚠️ High Discharge", "Warning", "high_load", send_via_email=b_active)
-    elif 1500 <= bat_discharge < 2000 and p_cap < 50: send_email("ℹ️ Moderate Discharge", "Info", "moderate_load", send_via_email=b_active)
+    state = {"gen_run": gen_run, "b_volt": b_volt, "b_active": b_active, "p_cap": p_cap, "discharge": bat_discharge}
+    # Every condition is sampled each poll, before the ladder stops early, so the debounce windows stay
+    # continuous. Stopping follows the live reading; only the send waits for the debounce
+    readings = [(alert_type, condition(state), stops, backup_only) for alert_type, condition, stops, backup_only in ALERT_LADDER]
+    held = {alert_type: debounced(alert_type, active) for alert_type, active, _, _ in readings}
+    for alert_type, active, stops, backup_only in readings:
+        if not active: continue
+        if held[alert_type]: send_alert(alert_type, send_via_email=b_active or not backup_only, now=now)
+        if stops: return
 
 # ----------------------------
 # Polling Loop
 # ----------------------------
-def poll_growatt():
-    global latest_data, load_history, battery_history, weather_forecast, last_communication, solar_conditions_cache
+def fetch_inverter(sn, now):
+    r = growatt_session.post(API_URL, data=STORAGE_SN_BODIES[sn], timeout=20)
+    r.raise_for_status()
+    data = orjson.loads(r.content).get("data", {})
+    last_communication[sn] = now  # single key write from the worker thread
+    return data
+
+def completed_within(futures, timeout):
+    """Yield futures as they finish, stopping quietly once `timeout` seconds have passed"""
+    try: yield from as_completed(futures, timeout=timeout)
+    except FuturesTimeout: pass
+
+def comm_lost_row(sn, now):
+    """Placeholder table row for an inverter silent for over 10 minutes, else None"""
+    if sn in last_communication and (now - last_communication[sn]) > timedelta(minutes=10):
+        cfg = INVERTER_CONFIG.get(sn, {})
+        return {"SN": sn, "Label": cfg.get('label', sn), "Type": cfg.get('type'), "DisplayOrder": cfg.get('display_order', 99), "communication_lost": True}
+    return None
+
+def refresh_weather():
+    global weather_forecast
+    forecast = get_weather_forecast()
+    if forecast:
+        weather_forecast = forecast
+        bump_render_version()
+
+def poll_weather():
+    """Refresh the forecast on its own thread so weather API latency never delays a Growatt poll"""
+    while True:
+        try: refresh_weather()
+        except Exception as e: log.error("Error fetching weather: %s", e)
+        first_weather_done.set()
+        time.sleep(WEATHER_REFRESH_MINUTES * 60)
+
+def poll_once():
+    """Poll every inverter once, publish the new snapshot and raise any alerts.
+    Returns True if at least one inverter answered."""
+    global latest_data
     global pool_pump_start_time, pool_pump_last_alert
 
-    weather_forecast = get_weather_forecast()
-    if weather_forecast: solar_conditions_cache = analyze_solar_conditions(weather_forecast)
-    last_wx = datetime.now(EAT)
+    now = datetime.now(EAT)
+    prune_alert_history(now)
+        
+    tot_out, tot_bat, tot_sol = 0, 0, 0
+    rows, p_caps = dict.fromkeys(ORDERED_SNS), []  # one slot per inverter, already in display order
+    b_data, gen_on = None, False
     
-    while True:
+    # Issue every inverter request at once; the cycle waits ~1 RTT instead of one per inverter
+    # and folds each answer in as soon as it arrives
+    pending = {poll_executor.submit(fetch_inverter, sn, now): sn for sn in SERIAL_NUMBERS}
+    answered = set()
+    for fut in completed_within(pending, POLL_FETCH_TIMEOUT):
+        sn = pending[fut]
+        answered.add(sn)
         try:
-            now = datetime.now(EAT)
-            alert_history[:] = [a for a in alert_history if a['timestamp'] >= (now - timedelta(hours=12))]
+            d = fut.result()
+            cfg = INVERTER_CONFIG.get(sn, {"label": sn, "type": "unknown", "display_order": 99})
             
-            if (now - last_wx) > timedelta(minutes=30):
-                weather_forecast = get_weather_forecast()
-                if weather_forecast: solar_conditions_cache = analyze_solar_conditions(weather_forecast)
-                last_wx = now
-                
-            tot_out, tot_bat, tot_sol = 0, 0, 0
-            inv_data, p_caps = [], []
-            b_data, gen_on = None, False
+            vals = {k: cast(d.get(k) or 0) for k, cast in NUMERIC_FIELDS}
+            op, cap, vb, pb = vals["outPutPower"], vals["capacity"], vals["vBat"], vals["pBat"]
+            sol = vals["ppv"] + vals["ppv2"]
+            tmp = max(vals["invTemperature"], vals["dcDcTemperature"], vals["temperature"])
+            flt = vals["errorCode"] != 0
+            hot = tmp >= INVERTER_TEMP_WARNING
             
-            for sn in SERIAL_NUMBERS:
-                try:
-                    r = requests.post(API_URL, data={"storage_sn": sn}, headers=headers, timeout=20)
-                    r.raise_for_status()
-                    d = r.json().get("data", {})
-                    last_communication[sn] = now
-                    cfg = INVERTER_CONFIG.get(sn, {"label": sn, "type": "unknown", "display_order": 99})
-                    
-                    op = float(d.get("outPutPower") or 0)
-                    cap = float(d.get("capacity") or 0)
-                    vb = float(d.get("vBat") or 0)
-                    pb = float(d.get("pBat") or 0)
-                    sol = float(d.get("ppv") or 0) + float(d.get("ppv2") or 0)
-                    tmp = max(float(d.get("invTemperature") or 0), float(d.get("dcDcTemperature") or 0), float(d.get("temperature") or 0))
-                    flt = int(d.get("errorCode") or 0) != 0
-                    
-                    tot_out += op
-                    tot_sol += sol
-                    if pb > 0: tot_bat += pb
-                    
-                    info = {
-                        "SN": sn, "Label": cfg['label'], "Type": cfg['type'], "DisplayOrder": cfg['display_order'],
-                        "OutputPower": op, "Capacity": cap, "vBat": vb, "pBat": pb, "ppv": sol, "temperature": tmp,
-                        "high_temperature": tmp >= 60, "Status": d.get("statusText", "Unknown"), "has_fault": flt,
-                        "last_seen": now.strftime("%Y-%m-%d %H:%M:%S"), "communication_lost": False
-                    }
-                    inv_data.append(info)
-                    
-                    if cfg['type'] == 'primary' and cap > 0: p_caps.append(cap)
-                    elif cfg['type'] == 'backup':
-                        b_data = info
-                        if float(d.get("vac") or 0) > 100 or float(d.get("pAcInPut") or 0) > 50: gen_on = True
-                except:
-                    if sn in last_communication and (now - last_communication[sn]) > timedelta(minutes=10):
-                        cfg = INVERTER_CONFIG.get(sn, {})
-                        inv_data.append({"SN": sn, "Label": cfg.get('label', sn), "Type": cfg.get('type'), "DisplayOrder": 99, "communication_lost": True})
-            
-            inv_data.sort(key=lambda x: x.get('DisplayOrder', 99))
-            update_patterns(tot_sol, tot_out)
-            
-            load_history.append((now, tot_out))
-            load_history[:] = [(t, p) for t, p in load_history if t >= (now - timedelta(days=14))]
-            battery_history.append((now, tot_bat))
-            battery_history[:] = [(t, p) for t, p in battery_history if t >= (now - timedelta(days=14))]
-            
-            s_pat = analyze_historical_solar_pattern()
-            l_pat = analyze_historical_load_pattern()
-            s_cast = generate_solar_forecast(weather_forecast, s_pat)
-            avg_load = calculate_moving_average_load(45)
-            l_cast = generate_load_forecast(l_pat, avg_load)
-            
-            p_min = min(p_caps) if p_caps else 0
-            b_volts = b_data['vBat'] if b_data else 0
-            b_act = b_data['OutputPower'] > 50 if b_data else False
-            b_pct = max(0, min(100, (b_volts - 51.0) / 2.0 * 100))
+            tot_out += op
+            tot_sol += sol
+            if pb > 0: tot_bat += pb
             
-            # Calculate usable energy with correct logic
-            usable = calculate_usable_energy(p_min, b_pct)
+            info = {
+                "SN": sn, "Label": cfg['label'], "Type": cfg['type'], "DisplayOrder": cfg['display_order'],
+                "OutputPower": op, "Capacity": cap, "vBat": vb, "pBat": pb, "ppv": sol, "temperature": tmp,
+                "high_temperature": hot, "temp_class": "text-danger" if hot else "text-success", "Status": d.get("statusText", "Unknown"), "has_fault": flt,
+                "last_seen": now.strftime("%Y-%m-%d %H:%M:%S"), "communication_lost": False
+            }
+            rows[sn] = info
             
-            pred = calculate_battery_cascade(s_cast, l_cast, p_min, b_act)
+            if sn in PRIMARY_BATTERY_SNS and cap > 0: p_caps.append(cap)
+            elif cfg['type'] == 'backup':
+                b_data = info
+                if check_generator_running(vals): gen_on = True
+        except:
+            rows[sn] = comm_lost_row(sn, now)
+    # Stragglers past the deadline count as unanswered this cycle; their late replies still refresh last_communication
+    for fut, sn in pending.items():
+        if sn in answered: continue
+        fut.cancel()
+        rows[sn] = comm_lost_row(sn, now)
+    inv_data = [row for row in rows.values() if row]
+    update_patterns(tot_sol, tot_out, now)
+    
+    history_times.append(now.timestamp())
+    load_history.append(min(65535, max(0, round(tot_out))))
+    battery_history.append(min(65535, max(0, round(tot_bat))))
+    history_labels.append(now.strftime('%d %b %H:%M'))
+    # Cap the count and drop points that aged out across polling gaps; one slice delete per column
+    drop = max(bisect_left(history_times, (now - timedelta(days=HISTORY_DAYS)).timestamp()), len(history_times) - HISTORY_MAX_POINTS)
+    if drop > 0:
+        for col in HISTORY_COLUMNS: del col[:drop]
+    
+    s_pat = analyze_historical_solar_pattern()
+    l_pat = analyze_historical_load_pattern()
+    s_cast = generate_solar_forecast(weather_forecast, s_pat, now)
+    avg_load = calculate_moving_average_load(45, now)
+    l_cast = generate_load_forecast(l_pat, avg_load, now)
+    
+    p_min = min(p_caps) if p_caps else 0
+    b_volts = b_data['vBat'] if b_data else 0
+    b_act = b_data['OutputPower'] > 50 if b_data else False
+    b_pct = max(0, min(100, (b_volts - 51.0) / 2.0 * 100))
+    
+    # Calculate usable energy with correct logic
+    usable = calculate_usable_energy(p_min, b_pct)
+    
+    # Average inverter temperature for the power-flow node (silent inverters count as 0, as before)
+    inv_temps = [i.get('temperature', 0) for i in inv_data]
+    inv_temp = f"{sum(inv_temps) / len(inv_temps):.0f}" if inv_temps else "0"
+    
+    pred = calculate_battery_cascade(s_cast, l_cast, p_min, b_act)
 
-            if now.hour >= 16:
-                if tot_bat > 1100:
-                    if pool_pump_start_time is None:
-                        pool_pump_start_time = now
-                    
-                    duration = now - pool_pump_start_time
-                    if duration > timedelta(hours=3) and now.hour >= 18:
-                        if pool_pump_last_alert is None or (now - pool_pump_last_alert) > timedelta(hours=1):
-                            duration_hours = int(duration.total_seconds() // 3600)
-                            send_email(
-                                "⚠️ HIGH LOAD ALERT: Pool Pumps?", 
-                                f"Battery discharge has been over 1.1kW for {duration_hours} hours. Did you leave the pool pumps on?", 
-                                "high_load_continuous"
-                            )
-                            pool_pump_last_alert = now
-                else:
-                    pool_pump_start_time = None
-            else:
-                pool_pump_start_time = None
-            
-            latest_data = {
-                "timestamp": now.strftime("%Y-%m-%d %H:%M:%S EAT"),
-                "total_output_power": tot_out,
-                "total_battery_discharge_W": tot_bat,
-                "total_solar_input_W": tot_sol,
-                "primary_battery_min": p_min,
-                "backup_battery_voltage": b_volts,
-                "backup_voltage_status": get_backup_voltage_status(b_volts)[0],
-                "backup_active": b_act,
-                "backup_percent_calc": b_pct,
-                "generator_running": gen_on,
-                "inverters": inv_data,
-                "solar_forecast": s_cast,
-                "load_forecast": l_cast,
-                "battery_life_prediction": pred,
-                "weather_source": weather_source,
-                "usable_energy": usable
-            }
+    if now.hour >= 16:
+        if tot_bat > 1100:
+            if pool_pump_start_time is None:
+                pool_pump_start_time = now
             
-            print(f"{latest_data['timestamp']} | Load={tot_out:.0f}W | Solar={tot_sol:.0f}W | Battery={usable['total_pct']:.0f}%")
-            check_alerts(inv_data, solar_conditions_cache, tot_sol, tot_bat, gen_on)
-        except Exception as e: print(f"Error in polling: {e}")
-        time.sleep(POLL_INTERVAL_MINUTES * 60)
+            duration = now - pool_pump_start_time
+            if duration > timedelta(hours=3) and now.hour >= 18:
+                if pool_pump_last_alert is None or (now - pool_pump_last_alert) > timedelta(hours=1):
+                    send_alert("high_load_continuous", {"hours": int(duration.total_seconds() // 3600)}, now=now)
+                    pool_pump_last_alert = now
+        else:
+            pool_pump_start_time = None
+    else:
+        pool_pump_start_time = None
+    
+    latest_data = {
+        "timestamp": now.strftime("%Y-%m-%d %H:%M:%S EAT"),
+        "total_output_power": tot_out,
+        "total_battery_discharge_W": tot_bat,
+        "total_solar_input_W": tot_sol,
+        "primary_battery_min": p_min,
+        "backup_battery_voltage": b_volts,
+        "backup_voltage_status": get_backup_voltage_status(b_volts)[0],
+        "backup_active": b_act,
+        "backup_percent_calc": b_pct,
+        "generator_running": gen_on,
+        "inverters": tuple(inv_data),  # frozen: readers share this snapshot
+        "solar_forecast": s_cast,
+        "load_forecast": l_cast,
+        "battery_life_prediction": pred,
+        "weather_source": weather_source,
+        "usable_energy": usable,
+        "inverter_temp": inv_temp,
+        "history_json": build_history_json()
+    }
+    bump_render_version()
+    
+    log.info("%s | Load=%.0fW | Solar=%.0fW | Battery=%.0f%%", latest_data['timestamp'], tot_out, tot_sol, usable['total_pct'])
+    check_alerts(inv_data, get_solar_conditions(now), tot_sol, tot_bat, gen_on, now)
+    flush_alerts()
+    # Render the new page here so the first visitor after a poll is served from cache
+    try: cached_dashboard()
+    except Exception as e: log.error("Error rendering dashboard: %s", e)
+    return any(not i.get('communication_lost') for i in inv_data)
+
+def poll_growatt():
+    # The first snapshot's solar/load forecasts and battery prediction need a forecast (real, stale or
+    # synthetic), so hold the first poll until the first weather attempt has finished
+    first_weather_done.wait(WEATHER_FETCH_TIMEOUT + 15)
+    period = POLL_INTERVAL_MINUTES * 60
+    failures = 0
+    next_run = time.monotonic()
+    while True:
+        try: ok = poll_once()
+        except Exception as e:
+            log.exception("Error in polling: %s", e)
+            ok = False
+        failures = 0 if ok else failures + 1
+        if failures:
+            # After a failed cycle retry sooner (2, 4, ... min, capped at the poll interval) with jitter
+            next_run = time.monotonic() + min(60 * 2 ** failures, period) + random.uniform(0, 5)
+        else:
+            # Fixed rate: due one period after the previous deadline, so poll time doesn't add drift;
+            # if a cycle overran a whole period, skip the missed tick instead of firing back-to-back
+            next_run = max(next_run + period, time.monotonic())
+        time.sleep(max(0, next_run - time.monotonic()))
+
+def start_poller():
+    """Start the background weather and Growatt pollers (once per process)"""
+    global poller_started
+    with poller_lock:
+        if poller_started: return
+        poller_started = True
+    Thread(target=poll_weather, daemon=True).start()
+    Thread(target=poll_growatt, daemon=True).start()
 
 # ----------------------------
 # API Endpoints
 # ----------------------------
+JSON_GZIP_MIN_BYTES = 1024  # smaller bodies don't gain enough to be worth the extra header and CPU
+
+@app.after_request
+def gzip_json(resp):
+    """Gzip the larger JSON responses for clients that accept it (the dashboard HTML is pre-compressed in home())"""
+    if resp.mimetype != "application/json": return resp
+    resp.vary.add("Accept-Encoding")
+    if (resp.status_code == 200 and not resp.content_encoding and accepts_gzip()
+            and (resp.content_length or 0) >= JSON_GZIP_MIN_BYTES):
+        resp.set_data(gzip.compress(resp.get_data(), compresslevel=6))
+        resp.content_encoding = "gzip"
+    return resp
+
 @app.route("/api/data")
 def api_data():
     """Real-time data endpoint for AJAX updates"""
-    p_bat = latest_data.get("primary_battery_min", 0)
-    b_volt = latest_data.get("backup_battery_voltage", 0)
-    tot_load = latest_data.get("total_output_power", 0)
-    tot_sol = latest_data.get("total_solar_input_W", 0)
-    tot_dis = latest_data.get("total_battery_discharge_W", 0)
+    snap = latest_data
+    p_bat = snap.get("primary_battery_min", 0)
+    b_volt = snap.get("backup_battery_voltage", 0)
+    tot_load = snap.get("total_output_power", 0)
+    tot_sol = snap.get("total_solar_input_W", 0)
+    tot_dis = snap.get("total_battery_discharge_W", 0)
     
     return jsonify({
-        "timestamp": latest_data.get('timestamp'),
+        "timestamp": snap.get('timestamp'),
         "load": tot_load,
         "solar": tot_sol,
         "discharge": tot_dis,
         "primary_battery": p_bat,
         "backup_voltage": b_volt,
-        "generator_running": latest_data.get("generator_running", False),
-        "backup_active": latest_data.get("backup_active", False),
-        "inverters": latest_data.get("inverters", []),
-        "usable_energy": latest_data.get("usable_energy", {}),
-        "alerts": [{"time": a['timestamp'].strftime("%H:%M"), "subject": a['subject'], "type": a['type']} for a in alert_history[-10:]]
+        "generator_running": snap.get("generator_running", False),
+        "backup_active": snap.get("backup_active", False),
+        "inverters": snap.get("inverters", []),
+        "usable_energy": snap.get("usable_energy", {}),
+        "alerts": [{"time": a['time'], "subject": a['subject'], "type": a['type']} for a in tuple(alert_history)[-10:]]
+    })
+
+@app.route("/api/history")
+def api_history():
+    """History chart series for the dashboard, pre-serialized by the poller.
+    The page requests it as /api/history?v=<snapshot timestamp>, so max_age only ever reuses the same snapshot"""
+    resp = Response(latest_data["history_json"], mimetype="application/json")
+    resp.cache_control.max_age = 60
+    return resp
+
+@app.route("/api/latest")
+def api_latest():
+    """Small snapshot for the dashboard's once-a-minute refresh check"""
+    snap = latest_data
+    usable = snap.get("usable_energy", {})
+    return jsonify({
+        "timestamp": snap.get("timestamp"),
+        "load": snap.get("total_output_power", 0),
+        "solar": snap.get("total_solar_input_W", 0),
+        "discharge": snap.get("total_battery_discharge_W", 0),
+        "battery_pct": usable.get("total_pct", 0)
     })
 
 # ----------------------------
 # Web Interface
 # ----------------------------
+def bump_render_version():
+    """Invalidate the cached dashboard after a poll, alert or weather refresh"""
+    global render_version
+    render_version = next(render_counter)
+
+def dashboard_etag():
+    """ETag for the current render version; the hour is included because the forecast charts start at 'now'"""
+    key = f"{boot_id}|{render_version}|{datetime.now(EAT).hour}"
+    return hashlib.md5(key.encode()).hexdigest()
+
+def cached_dashboard():
+    """(etag, body, gzipped body, last modified) for the current render version, rendering only on a version change"""
+    global cached_page
+    etag = dashboard_etag()  # before the snapshot: the poller rebinds latest_data, then bumps the version
+    page = cached_page
+    if page[0] != etag:
+        body = render_dashboard(latest_data).encode("utf-8")
+        # HTTP dates have whole-second resolution: keep each render strictly newer than the last
+        modified = datetime.now(timezone.utc).replace(microsecond=0)
+        if page[3] and modified <= page[3]: modified = page[3] + timedelta(seconds=1)
+        page = cached_page = (etag, body, gzip.compress(body, compresslevel=6), modified)
+    return page
+
+def accepts_gzip():
+    """True if the client accepts gzip; honours q-values, so "gzip;q=0" is a refusal, and "*" counts"""
+    return request.accept_encodings["gzip"] > 0
+
 @app.route("/")
 def home():
+    etag = dashboard_etag()
+    use_gzip = accepts_gzip()
+    tag = etag + "-gz" if use_gzip else etag  # each encoding is a distinct representation
+    if tag in request.if_none_match:
+        resp = Response(status=304)
+    else:
+        # Every visitor within a poll cycle gets the same bytes; the poller usually rendered them already
+        etag, body, body_gz, modified = cached_dashboard()
+        tag = etag + "-gz" if use_gzip else etag
+        ims = request.if_modified_since
+        if not request.if_none_match and ims and modified <= ims:
+            resp = Response(status=304)  # If-None-Match, when sent, takes precedence over If-Modified-Since
+        else:
+            resp = Response(body_gz if use_gzip else body, mimetype="text/html")
+            if use_gzip: resp.content_encoding = "gzip"
+        resp.last_modified = modified
+    resp.vary.add("Accept-Encoding")
+    resp.set_etag(tag)
+    resp.cache_control.max_age = 60
+    return resp
+
+def render_dashboard(snap):
     def _num(val):
         """Safe number conversion"""
         try:
@@ -623,18 +999,20 @@ def home():
         except (ValueError, TypeError):
             return 0
     
+    now = datetime.now(EAT)  # one clock read for the whole render
+    
     # Extract data safely
-    p_bat = _num(latest_data.get("primary_battery_min", 0))
-    b_volt = _num(latest_data.get("backup_battery_voltage", 0))
-    b_stat = latest_data.get("backup_voltage_status", "Unknown")
-    b_active = latest_data.get("backup_active", False)
-    gen_on = latest_data.get("generator_running", False)
-    tot_load = _num(latest_data.get("total_output_power", 0))
-    tot_sol = _num(latest_data.get("total_solar_input_W", 0))
-    tot_dis = _num(latest_data.get("total_battery_discharge_W", 0))
+    p_bat = _num(snap.get("primary_battery_min", 0))
+    b_volt = _num(snap.get("backup_battery_voltage", 0))
+    b_stat = snap.get("backup_voltage_status", "Unknown")
+    b_active = snap.get("backup_active", False)
+    gen_on = snap.get("generator_running", False)
+    tot_load = _num(snap.get("total_output_power", 0))
+    tot_sol = _num(snap.get("total_solar_input_W", 0))
+    tot_dis = _num(snap.get("total_battery_discharge_W", 0))
     
     # Get corrected usable energy
-    usable = latest_data.get("usable_energy", {
+    usable = snap.get("usable_energy", {
         "primary_kwh": 0,
         "backup_kwh": 0,
         "total_kwh": 0,
@@ -642,9 +1020,9 @@ def home():
         "total_usable_capacity": 29.76
     })
     
-    b_pct = _num(latest_data.get("backup_percent_calc", 0))
+    b_pct = _num(snap.get("backup_percent_calc", 0))
     
-    sol_cond = solar_conditions_cache
+    sol_cond = get_solar_conditions(now)
     weather_bad = sol_cond and sol_cond['poor_conditions']
     surplus_power = tot_sol - tot_load
 
@@ -680,31 +1058,18 @@ def home():
         app_st, app_sub, app_col = "ℹ️ NORMAL", "System running", "normal"
         status_icon = "ℹ️"
     
-    # Chart data
-    if not load_history:
-        times = [datetime.now(EAT).strftime('%d %b %H:%M')]
-        l_vals = [tot_load]
-        b_vals = [tot_dis]
-    else:
-        total_points = len(load_history)
-        step = max(1, total_points // 150)
-        times = [t.strftime('%d %b %H:%M') for i, (t, p) in enumerate(load_history) if i % step == 0]
-        l_vals = [p for i, (t, p) in enumerate(load_history) if i % step == 0]
-        b_vals = [p for i, (t, p) in enumerate(battery_history) if i % step == 0]
-    
-    pred = latest_data.get("battery_life_prediction")
-    sim_t = ["Now"] + [d['time'].strftime('%H:%M') for d in latest_data.get("solar_forecast", [])]
+    pred = snap.get("battery_life_prediction")
+    sim_t = ["Now"] + [d['time'].strftime('%H:%M') for d in snap.get("solar_forecast", [])]
     trace_pct = pred.get('trace_total_pct', []) if pred else []
     
-    s_forecast = latest_data.get("solar_forecast", [])
-    l_forecast = latest_data.get("load_forecast", [])
+    s_forecast = snap.get("solar_forecast", [])
+    l_forecast = snap.get("load_forecast", [])
     
     if s_forecast and l_forecast:
         forecast_times = [d['time'].strftime('%H:%M') for d in s_forecast[:12]]
         forecast_solar = [d['estimated_generation'] for d in s_forecast[:12]]
         forecast_load = [d['estimated_load'] for d in l_forecast[:12]]
     else:
-        now = datetime.now(EAT)
         forecast_times = []
         forecast_solar = []
         forecast_load = []
@@ -727,9 +1092,7 @@ def home():
     load_line_width = max(2, min(8, tot_load / 1000))
     battery_line_width = max(2, min(8, tot_dis / 1000))
     
-    # Inverter temperature
-    inverter_temps = [inv.get('temperature', 0) for inv in latest_data.get('inverters', [])]
-    inverter_temp = f"{(sum(inverter_temps) / len(inverter_temps)):.0f}" if inverter_temps else "0"
+    inverter_temp = snap.get("inverter_temp", "0")
     
     # Trends
     load_trend_icon = "↑" if tot_load > 2000 else "→" if tot_load > 1000 else "↓"
@@ -749,8 +1112,8 @@ def home():
     else:
         battery_bar_color = "danger"
     
-    alerts = [{"time": a['timestamp'].strftime("%H:%M"), "subject": a['subject'], "type": a['type']} 
-              for a in reversed(alert_history[-10:])]
+    alerts = [{"time": a['time'], "subject": a['subject'], "type": a['type']} 
+              for a in reversed(tuple(alert_history)[-10:])]
     
     # Smart Recommendations - UPDATED LOGIC: only recommend heavy loads when primary battery > 75%
     recommendation_items = []
@@ -837,7 +1200,7 @@ def home():
         
         # Cloud warnings
         next_3_gen = sum([d['estimated_generation'] for d in s_forecast[:3]]) / 3 if len(s_forecast) >= 3 else 0
-        current_hour = datetime.now(EAT).hour
+        current_hour = now.hour
         if next_3_gen < 500 and 8 <= current_hour <= 16:
             schedule_items.append({
                 'icon': '☁️',
@@ -852,7 +1215,50 @@ def home():
     else:
         runtime_hours = 0
 
-    html_template = """
+    return DASHBOARD_HEAD + dashboard_template.render(
+        timestamp=snap.get('timestamp', 'Initializing...'),
+        status_icon=status_icon,
+        app_st=app_st,
+        app_sub=app_sub,
+        app_col=app_col,
+        tot_load=tot_load,
+        tot_sol=tot_sol,
+        tot_dis=tot_dis,
+        p_bat=p_bat,
+        b_volt=b_volt,
+        b_pct=b_pct,
+        b_stat=b_stat,
+        usable=usable,
+        load_trend_icon=load_trend_icon,
+        load_trend_text=load_trend_text,
+        solar_trend_icon=solar_trend_icon,
+        solar_trend_text=solar_trend_text,
+        primary_color=primary_color,
+        backup_color=backup_color,
+        battery_bar_color=battery_bar_color,
+        solar_active=solar_active,
+        battery_charging=battery_charging,
+        battery_discharging=battery_discharging,
+        gen_on=gen_on,
+        b_active=b_active,
+        inverter_temp=inverter_temp,
+        solar_line_width=solar_line_width,
+        load_line_width=load_line_width,
+        battery_line_width=battery_line_width,
+        recommendation_items=recommendation_items,
+        schedule_items=schedule_items,
+        forecast_times=forecast_times,
+        forecast_solar=forecast_solar,
+        forecast_load=forecast_load,
+        sim_t=sim_t,
+        trace_pct=trace_pct,
+        latest_data=snap,
+        alerts=alerts,
+        runtime_hours=runtime_hours
+    )
+
+# Static <head> (fonts, Chart.js, CSS): no template tags, so it is prepended as-is instead of going through Jinja
+DASHBOARD_HEAD = """
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -1445,7 +1851,9 @@ def home():
         }
     </style>
 </head>
-<body>
+"""
+
+DASHBOARD_HTML = """<body>
     <div class="container">
         <div class="dashboard-grid">
             <header>
@@ -1555,8 +1963,11 @@ def home():
                 <h2>⚙️ Inverter Status</h2>
                 <div class="inv-grid">
                 {% for inv in latest_data.get('inverters', []) %}
-                    <div class="inv-card {{ 'fault' if inv.has_fault else '' }}">
+                    <div class="inv-card {{ 'fault' if inv.has_fault or inv.communication_lost else '' }}">
                         <div style="font-weight: 700; font-size: 0.9rem; margin-bottom: 0.5rem">{{ inv.Label }}</div>
+                        {% if inv.communication_lost %}
+                        <div class="text-danger" style="font-size: 0.8rem;">📡 No communication</div>
+                        {% else %}
                         <div style="display:flex; justify-content:space-between; font-size: 0.8rem; margin-bottom: 4px;">
                             <span style="color:var(--text-muted)">Out:</span>
                             <span style="font-family:'Space Mono'">{{ '%0.f'|format(inv.OutputPower) }}W</span>
@@ -1567,8 +1978,9 @@ def home():
                         </div>
                         <div style="display:flex; justify-content:space-between; font-size: 0.8rem;">
                             <span style="color:var(--text-muted)">Temp:</span>
-                            <span class="{{ 'text-danger' if inv.high_temperature else 'text-success' }}">{{ '%0.f'|format(inv.temperature) }}°C</span>
+                            <span class="{{ inv.temp_class }}">{{ '%0.f'|format(inv.temperature) }}°C</span>
                         </div>
+                        {% endif %}
                     </div>
                 {% endfor %}
                 </div>
@@ -1731,15 +2143,16 @@ def home():
             }
         });
         
-        // History
-        new Chart(document.getElementById('historyChart'), {
+        // History (fetched separately; the series are serialized once per poll). The snapshot timestamp
+        // in the URL gives each poll its own cache entry, so a reload never shows the previous poll's chart
+        fetch('/api/history?v={{ latest_data.timestamp|urlencode }}').then(r => r.json()).then(h => new Chart(document.getElementById('historyChart'), {
             type: 'line',
             data: {
-                labels: {{ times|tojson }},
+                labels: h.times,
                 datasets: [
                     { 
                         label: 'Load', 
-                        data: {{ l_vals|tojson }}, 
+                        data: h.load, 
                         borderColor: '#58a6ff', 
                         borderWidth: 2, 
                         pointRadius: 0,
@@ -1747,7 +2160,7 @@ def home():
                     },
                     { 
                         label: 'Discharge', 
-                        data: {{ b_vals|tojson }}, 
+                        data: h.battery, 
                         borderColor: '#f85149', 
                         borderWidth: 2, 
                         pointRadius: 0,
@@ -1756,7 +2169,7 @@ def home():
                 ]
             },
             options: commonOptions
-        });
+        }));
         
         // NEW: Dynamic pulse animation for active nodes
         function updatePulseAnimations() {
@@ -1821,62 +2234,17 @@ def home():
         
         // Auto Refresh
         setInterval(() => {
-            fetch('/api/data').then(r => r.json()).then(d => {
+            fetch('/api/latest').then(r => r.json()).then(d => {
                 if(d.timestamp !== "{{ latest_data.timestamp }}") location.reload();
             });
         }, 60000);
     </script>
 </body>
 </html>
-    """
-    
-    from flask import render_template_string
-    return render_template_string(
-        html_template,
-        timestamp=latest_data.get('timestamp', 'Initializing...'),
-        status_icon=status_icon,
-        app_st=app_st,
-        app_sub=app_sub,
-        app_col=app_col,
-        tot_load=tot_load,
-        tot_sol=tot_sol,
-        tot_dis=tot_dis,
-        p_bat=p_bat,
-        b_volt=b_volt,
-        b_pct=b_pct,
-        b_stat=b_stat,
-        usable=usable,
-        load_trend_icon=load_trend_icon,
-        load_trend_text=load_trend_text,
-        solar_trend_icon=solar_trend_icon,
-        solar_trend_text=solar_trend_text,
-        primary_color=primary_color,
-        backup_color=backup_color,
-        battery_bar_color=battery_bar_color,
-        solar_active=solar_active,
-        battery_charging=battery_charging,
-        battery_discharging=battery_discharging,
-        gen_on=gen_on,
-        b_active=b_active,
-        inverter_temp=inverter_temp,
-        solar_line_width=solar_line_width,
-        load_line_width=load_line_width,
-        battery_line_width=battery_line_width,
-        recommendation_items=recommendation_items,
-        schedule_items=schedule_items,
-        forecast_times=forecast_times,
-        forecast_solar=forecast_solar,
-        forecast_load=forecast_load,
-        sim_t=sim_t,
-        trace_pct=trace_pct,
-        times=times,
-        l_vals=l_vals,
-        b_vals=b_vals,
-        latest_data=latest_data,
-        alerts=alerts,
-        runtime_hours=runtime_hours
-    )
+"""
+# Compiled once at import; render_template_string would re-parse the template on every request
+dashboard_template = app.jinja_env.from_string(DASHBOARD_HTML)
 
 if __name__ == "__main__":
-    Thread(target=poll_growatt, daemon=True).start()
+    start_poller()
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 10000)))